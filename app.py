@@ -15,6 +15,8 @@
 
 import io
 import os
+import hashlib
+import logging
 import datetime as dt
 from pathlib import Path
 
@@ -31,52 +33,255 @@ import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 
+try:
+    import numba
+    from numba import njit, prange
+except ImportError:  # numpy comparison fallback in compliance_flags()
+    njit = None
+
+try:
+    import plotly.graph_objects as go
+    import plotly.io as pio
+except ImportError:  # matplotlib fallback in _chart_png()
+    go = None
+
+from refresh_pipeline import OUTDIR, atomic_write, detect_date_format, load_source, source_columns, to_csv_bytes
+
 APP_TITLE = "Healthcare Waiting-Time Compliance Dashboard"
 DEFAULT_TARGET_MIN = 30     # default compliance target (minutes)
 DEFAULT_ALERT_DAYS = 30     # license expiring soon threshold
+RISK_LEVELS = ["Unknown", "⛔ Expired", "⚠️ Expiring Soon", "OK"]  # license Risk categories, by code
+CHUNKED_CSV_BYTES = 100 * 1024 * 1024  # larger CSV uploads are aggregated in chunks
+CSV_CHUNK_ROWS = 500_000
+PLOT_CACHE = OUTDIR / ".plot_cache"  # PowerPoint chart PNGs, keyed by data hash
+PLOT_CACHE_SIZE = 64                 # most recently used PNGs kept on disk
+PNG_HEAD, PNG_TAIL = b"\x89PNG\r\n\x1a\n", b"IEND\xaeB`\x82"  # signature and final chunk of a complete PNG
+FRAME_CACHE_ENTRIES = 4   # raw frames kept per cached loader
+TABLE_CACHE_ENTRIES = 32  # small aggregated tables, CSV bytes and PNGs
+
+# Derived frames share unchanged columns with their source instead of copying them
+pd.set_option("mode.copy_on_write", True)
 
 st.set_page_config(page_title=APP_TITLE, page_icon="🩺", layout="wide")
 
 # ---------- Helpers ----------
-def load_data(file) -> pd.DataFrame:
-    # Accept Excel or CSV
+def _is_excel(name):
+    # Excel by default, CSV only when the extension says so
+    return not name.lower().endswith(".csv")
+
+def _file_bytes(file):
+    return file.read_bytes() if isinstance(file, Path) else file.getvalue()
+
+def data_key(file):
+    # Identifies the loaded data for the frame caches below: st.cache_data hashes large
+    # frames from a row sample only, so the frames themselves are not used as keys
+    if isinstance(file, Path):
+        stat = file.stat()
+        return (str(file.resolve()), stat.st_size, stat.st_mtime_ns)
+    return hashlib.sha1(file.getvalue()).hexdigest()
+
+@st.cache_data(show_spinner=False, max_entries=TABLE_CACHE_ENTRIES)
+def _read_columns(bytes_, name) -> list:
+    buf = io.BytesIO(bytes_)
+    return (pd.read_excel(buf, nrows=0) if _is_excel(name) else pd.read_csv(buf, nrows=0)).columns.tolist()
+
+@st.cache_data(show_spinner=False, max_entries=FRAME_CACHE_ENTRIES)
+def _load(bytes_, name, columns=None) -> pd.DataFrame:
+    buf = io.BytesIO(bytes_)
+    return pd.read_excel(buf, usecols=columns) if _is_excel(name) else pd.read_csv(buf, usecols=columns)
+
+@st.cache_data(show_spinner=False, max_entries=FRAME_CACHE_ENTRIES)
+def _load_source(path, signature, columns=None) -> pd.DataFrame:
+    # `signature` (size, mtime) is only part of the cache key, so an edited workbook is re-read
+    return load_source(path, columns=columns)
+
+def read_columns(file) -> list:
+    # Column names only, so the sidebar mapping can drive which columns get loaded
     if file is None:
         st.warning("Please upload your dataset (Excel/CSV) from the sidebar or keep the bundled example.")
+        return []
+    name = getattr(file, "name", "uploaded")
+    try:
+        if isinstance(file, Path) and name.lower().endswith(".xlsx"):
+            return source_columns(file)
+        return _read_columns(_file_bytes(file), name)
+    except Exception as e:
+        st.error(f"Failed to read file: {e}")
+        return []
+
+def load_data(file, columns=None) -> pd.DataFrame:
+    # Accept Excel or CSV
+    if file is None:
         return pd.DataFrame()
     name = getattr(file, "name", "uploaded")
     try:
-        if name.lower().endswith((".xlsx", ".xls")):
-            df = pd.read_excel(file)
-        elif name.lower().endswith(".csv"):
-            df = pd.read_csv(file)
+        if isinstance(file, Path) and name.lower().endswith(".xlsx"):
+            # On-disk workbook: served from the Parquet cache keyed by file size+mtime
+            stat = file.stat()
+            df = _load_source(str(file), (stat.st_size, stat.st_mtime_ns), columns)
         else:
-            # try Excel by default
-            df = pd.read_excel(file)
+            df = _load(_file_bytes(file), name, columns)
     except Exception as e:
         st.error(f"Failed to read file: {e}")
         return pd.DataFrame()
     return df
 
-def coerce_datetime(s):
-    return pd.to_datetime(s, errors="coerce")
+def coerce_datetime(s, fmt=None):
+    # Parse with one format (given, or detected from a sample) instead of per-row dateutil inference
+    if not (pd.api.types.is_object_dtype(s) or pd.api.types.is_string_dtype(s)):
+        return pd.to_datetime(s, errors="coerce")
+    fmt = fmt or detect_date_format(s)
+    if fmt is None:
+        return pd.to_datetime(s, errors="coerce")
+    return pd.to_datetime(s, format=fmt, errors="coerce", cache=True)
 
 def coerce_numeric(s):
     return pd.to_numeric(s, errors="coerce")
 
 def infer_week_start(d):
-    # Monday as week start
-    return (d - pd.to_timedelta((d.dt.dayofweek), unit="d")).dt.normalize()
+    # Monday as week start ("W-SUN" periods run Monday..Sunday)
+    return d.dt.to_period("W-SUN").dt.start_time
+
+if njit is not None:
+    # Each Streamlit session runs in its own thread, and the fallback workqueue layer aborts the
+    # process on concurrent launches. OpenMP is thread-safe ("threadsafe" would try TBB first,
+    # which can hang the interpreter at exit)
+    numba.config.THREADING_LAYER = "omp"
+
+    # No fastmath: it lets LLVM assume no NaNs, and NaN minutes must compare False
+    @njit(parallel=True, cache=True)
+    def _compliant(mins, target, out):
+        for i in prange(mins.shape[0]):
+            out[i] = mins[i] <= target
+
+def compliance_flags(minutes, target):
+    # Plain 1-byte bools; NaN minutes compare False, i.e. count as noncompliant
+    mins = minutes.to_numpy(np.float32, copy=False)
+    if njit is not None:
+        out = np.empty(mins.shape, np.bool_)
+        try:
+            _compliant(mins, float(target), out)
+            return out
+        except ValueError:  # no OpenMP runtime could be loaded
+            pass
+    return mins <= target
+
+def prepare_frame(df, visit_col, dept_col, doctor_col, wait_col, start_col, seen_col, license_col, target, formats=None):
+    # Coerced, row-level frame used by every aggregation; `formats` maps date columns to fixed formats
+    formats = formats or {}
+    if wait_col:
+        minutes = coerce_numeric(df[wait_col])
+    else:
+        minutes = (coerce_datetime(df[seen_col], formats.get(seen_col))
+                   - coerce_datetime(df[start_col], formats.get(start_col))).dt.total_seconds() / 60.0
+
+    # Column-prune once minutes are derived: only these travel into the group-bys and tables.
+    # .loc + .assign build the pruned frame without first copying the whole raw frame
+    keep = list(dict.fromkeys(c for c in (visit_col, dept_col, doctor_col, license_col) if c))
+    # Coerce dates
+    coerced = {visit_col: coerce_datetime(df[visit_col], formats.get(visit_col))}
+    if license_col:
+        coerced[license_col] = coerce_datetime(df[license_col], formats.get(license_col))
+    # Group on integer category codes rather than hashing strings (a column mapped as a date stays a date)
+    for c in (dept_col, doctor_col):
+        if c not in coerced:
+            coerced[c] = df[c].astype("category")
+    # float32 halves the bytes scanned; also turns nullable <NA> into NaN
+    df = df.loc[:, keep].assign(**coerced, waiting_minutes=minutes.astype("float32"))
+
+    # Week start (Monday)
+    df = df.dropna(subset=[visit_col])
+    return df.assign(
+        is_compliant=compliance_flags(df["waiting_minutes"], target),
+        week_start=infer_week_start(df[visit_col]),
+    )
+
+def aggregate_frame(df, dept_col, doctor_col, license_col):
+    # Group-bys independent of the threshold/alert sliders
+    weekly = df.groupby("week_start")["is_compliant"].mean().mul(100).reset_index().rename(columns={"is_compliant":"compliance_pct"})
 
-def format_pct(x):
-    if pd.isna(x):
-        return ""
-    return f"{x:.1f}%"
+    # Shared by the KPI strip and the department tab
+    dept_series = df.groupby(dept_col, observed=True)["is_compliant"].mean().mul(100)
+
+    # One pass per doctor for compliance, visit count and latest license expiry
+    doctor_aggs = {"mean": ("is_compliant", "mean"), "Visits": ("is_compliant", "count")}
+    if license_col:
+        doctor_aggs["License Expiry"] = (license_col, "max")
+    doctor = df.groupby(doctor_col, observed=True).agg(**doctor_aggs).reset_index()
+    doctor["Compliance %"] = doctor["mean"]*100
+    doctor.rename(columns={doctor_col:"Doctor"}, inplace=True)
+    return weekly, dept_series, doctor
+
+@st.cache_data(show_spinner=False, max_entries=TABLE_CACHE_ENTRIES)
+def _summarize(_file, key, columns, visit_col, dept_col, doctor_col, wait_col, start_col, seen_col, license_col, target):
+    # Load, prepare and aggregate in one step keyed by data_key(): reruns with unchanged data, mapping
+    # and target (e.g. a slider move) read no rows at all. None if the file could not be loaded
+    raw = load_data(_file, columns=columns)
+    if raw.empty:
+        return None
+    df = prepare_frame(raw, visit_col, dept_col, doctor_col, wait_col, start_col, seen_col, license_col, target)
+    total_visits, compliant_visits = len(df), int(df["is_compliant"].sum())
+    has_minutes = bool(df["waiting_minutes"].notna().any())
+    if not total_visits or not has_minutes:
+        # The caller stops before using the tables
+        return total_visits, compliant_visits, has_minutes, None, None, None
+    return (total_visits, compliant_visits, has_minutes, *aggregate_frame(df, dept_col, doctor_col, license_col))
+
+def is_large_csv(file) -> bool:
+    # Uploads past CHUNKED_CSV_BYTES are aggregated chunk by chunk instead of loaded whole
+    name = getattr(file, "name", "uploaded")
+    return not isinstance(file, Path) and not _is_excel(name) and len(file.getvalue()) > CHUNKED_CSV_BYTES
+
+def _chunk_partials(df, dept_col, doctor_col, license_col):
+    # Per-key compliant sums and visit counts; unlike means, these add up across chunks
+    weekly = df.groupby("week_start")["is_compliant"].agg(["sum","count"])
+    dept = df.groupby(dept_col, observed=True)["is_compliant"].agg(["sum","count"])
+    doctor_aggs = {"sum": ("is_compliant", "sum"), "count": ("is_compliant", "count")}
+    if license_col:
+        doctor_aggs["License Expiry"] = (license_col, "max")
+    doctor = df.groupby(doctor_col, observed=True).agg(**doctor_aggs)
+    return weekly, dept, doctor
+
+@st.cache_data(show_spinner=False, max_entries=TABLE_CACHE_ENTRIES)
+def _stream_csv(bytes_, columns, visit_col, dept_col, doctor_col, wait_col, start_col, seen_col, license_col, target):
+    # Same outputs as _summarize, but only one chunk of rows is ever in memory
+    parts, has_minutes, formats = [], False, {}
+    for chunk in pd.read_csv(io.BytesIO(bytes_), usecols=columns, chunksize=CSV_CHUNK_ROWS):
+        # Date formats are detected once, from the first values like a whole-file load, so every chunk parses alike
+        for c in (visit_col, start_col, seen_col, license_col):
+            if c and c not in formats and chunk[c].notna().any():
+                formats[c] = detect_date_format(chunk[c])
+        chunk = prepare_frame(chunk, visit_col, dept_col, doctor_col, wait_col, start_col, seen_col, license_col, target, formats)
+        if chunk.empty:
+            continue
+        has_minutes = has_minutes or bool(chunk["waiting_minutes"].notna().any())
+        parts.append(_chunk_partials(chunk, dept_col, doctor_col, license_col))
+    if not parts:
+        # No valid visit dates anywhere; the caller stops before using the tables
+        return 0, 0, False, None, None, None
+    weekly_parts, dept_parts, doctor_parts = zip(*parts)
+
+    weekly = pd.concat(weekly_parts).groupby(level=0).sum()
+    total_visits, compliant_visits = int(weekly["count"].sum()), int(weekly["sum"].sum())
+    weekly = weekly["sum"].div(weekly["count"]).mul(100).rename("compliance_pct").reset_index()
+
+    dept = pd.concat(dept_parts).groupby(level=0, observed=True).sum()
+    dept_series = dept["sum"].div(dept["count"]).mul(100)
+
+    doctor_merge = {"sum": "sum", "count": "sum"}
+    if license_col:
+        doctor_merge["License Expiry"] = "max"
+    doctor = pd.concat(doctor_parts).groupby(level=0, observed=True).agg(doctor_merge).reset_index()
+    doctor.rename(columns={doctor_col:"Doctor", "count":"Visits"}, inplace=True)
+    doctor.insert(1, "mean", doctor.pop("sum") / doctor["Visits"])
+    doctor["Compliance %"] = doctor["mean"]*100
+    return total_visits, compliant_visits, has_minutes, weekly, dept_series, doctor
 
-def traffic_light(p):
-    # p in 0-100
-    if pd.isna(p):
-        return "⚪"
-    return "🟢" if p >= dept_threshold else "🔴"
+@st.cache_data(show_spinner=False, max_entries=TABLE_CACHE_ENTRIES)
+def _csv_bytes(df):
+    # download_button needs the bytes up front (no lazy data in this Streamlit), so each table
+    # is serialized once per distinct content rather than on every rerun
+    return to_csv_bytes(df)
 
 def figure_to_bytes(fig, dpi=150):
     buf = io.BytesIO()
@@ -85,6 +290,87 @@ def figure_to_bytes(fig, dpi=150):
     buf.seek(0)
     return buf
 
+def _render_weekly(weekly_df):
+    fig, ax = plt.subplots(figsize=(6,3))
+    if not weekly_df.empty:
+        ax.plot(weekly_df["week_start"], weekly_df["compliance_pct"])
+        ax.set_title("Weekly Waiting-Time Compliance (%)")
+        ax.set_xlabel("Week Start")
+        ax.set_ylabel("Compliance %")
+        ax.grid(True, alpha=0.3)
+    return figure_to_bytes(fig).getvalue()
+
+def _render_dept(dept_df):
+    fig, ax = plt.subplots(figsize=(6,3))
+    if not dept_df.empty:
+        ax.barh(dept_df["Department"], dept_df["Compliance %"])
+        ax.set_title("Department Compliance (%)")
+        ax.set_xlabel("Compliance %")
+        ax.set_ylabel("Department")
+        ax.grid(True, axis="x", alpha=0.3)
+    return figure_to_bytes(fig).getvalue()
+
+def _plotly_png(fig, title, xlabel, ylabel):
+    # Rasterized by kaleido's headless browser; 900x450 px like the matplotlib 6x3in @ 150 dpi
+    fig.update_layout(title=title, xaxis_title=xlabel, yaxis_title=ylabel,
+                      template="plotly_white", margin=dict(l=60, r=20, t=50, b=50))
+    return pio.to_image(fig, format="png", width=600, height=300, scale=1.5)
+
+def _render_weekly_plotly(weekly_df):
+    fig = go.Figure(go.Scatter(x=weekly_df["week_start"], y=weekly_df["compliance_pct"], mode="lines"))
+    return _plotly_png(fig, "Weekly Waiting-Time Compliance (%)", "Week Start", "Compliance %")
+
+def _render_dept_plotly(dept_df):
+    fig = go.Figure(go.Bar(x=dept_df["Compliance %"], y=dept_df["Department"], orientation="h"))
+    return _plotly_png(fig, "Department Compliance (%)", "Compliance %", "Department")
+
+def _frame_digest(df):
+    h = hashlib.sha1("\x1f".join(map(str, df.columns)).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+def _disk_cached_png(kind, df, render):
+    # PNGs persisted under PLOT_CACHE by data hash, so exports skip matplotlib across sessions and restarts;
+    # `kind` names the chart and its renderer, so changing either never serves a stale image
+    path = PLOT_CACHE / f"{kind}-{_frame_digest(df)}.png"
+    try:
+        png = path.read_bytes()
+        # A missing, empty or truncated file is a miss and gets rewritten
+        if png.startswith(PNG_HEAD) and png.endswith(PNG_TAIL):
+            path.touch()  # mtime doubles as last-used time for eviction
+            return png
+    except OSError:
+        pass
+    png = render(df)
+    try:
+        PLOT_CACHE.mkdir(parents=True, exist_ok=True)
+        # Shared by every session: replaced atomically so no reader sees a partial PNG
+        atomic_write(path, lambda tmp: Path(tmp).write_bytes(png))
+        for old in sorted(PLOT_CACHE.glob("*.png"), key=lambda p: p.stat().st_mtime)[:-PLOT_CACHE_SIZE]:
+            old.unlink(missing_ok=True)
+    except OSError:
+        pass
+    return png
+
+def _chart_png(chart, df, render_plotly, render_mpl):
+    # plotly/kaleido when installed, matplotlib otherwise or if kaleido cannot render
+    if go is not None:
+        try:
+            return _disk_cached_png(f"{chart}-plotly", df, render_plotly)
+        except (ValueError, RuntimeError) as e:
+            # ValueError: kaleido not installed; RuntimeError: kaleido 1.x cannot find/start Chrome
+            logging.getLogger(__name__).warning("plotly chart export failed, using matplotlib: %s", str(e).strip())
+    return _disk_cached_png(f"{chart}-mpl", df, render_mpl)
+
+# Chart PNGs only depend on the plotted data, so repeated exports skip rasterization
+@st.cache_data(show_spinner=False, max_entries=TABLE_CACHE_ENTRIES)
+def _weekly_png(weekly_df):
+    return _chart_png("weekly", weekly_df, _render_weekly_plotly, _render_weekly)
+
+@st.cache_data(show_spinner=False, max_entries=TABLE_CACHE_ENTRIES)
+def _dept_png(dept_df):
+    return _chart_png("dept", dept_df, _render_dept_plotly, _render_dept)
+
 def make_powerpoint(summary, weekly_df, dept_df, doc_df, outfile):
     prs = Presentation()
     # Title Slide
@@ -109,26 +395,12 @@ def make_powerpoint(summary, weekly_df, dept_df, doc_df, outfile):
     chart_slide.shapes.title.text = "Weekly & Department Compliance"
 
     # Weekly line chart
-    fig1, ax1 = plt.subplots(figsize=(6,3))
-    if not weekly_df.empty:
-        ax1.plot(weekly_df["week_start"], weekly_df["compliance_pct"])
-        ax1.set_title("Weekly Waiting-Time Compliance (%)")
-        ax1.set_xlabel("Week Start")
-        ax1.set_ylabel("Compliance %")
-        ax1.grid(True, alpha=0.3)
-    img1 = figure_to_bytes(fig1)
+    img1 = io.BytesIO(_weekly_png(weekly_df))
     left = Inches(0.5); top = Inches(1.5); width = Inches(4.5)
     chart_slide.shapes.add_picture(img1, left, top, width=width)
 
     # Department bar chart
-    fig2, ax2 = plt.subplots(figsize=(6,3))
-    if not dept_df.empty:
-        ax2.barh(dept_df["Department"], dept_df["Compliance %"])
-        ax2.set_title("Department Compliance (%)")
-        ax2.set_xlabel("Compliance %")
-        ax2.set_ylabel("Department")
-        ax2.grid(True, axis="x", alpha=0.3)
-    img2 = figure_to_bytes(fig2)
+    img2 = io.BytesIO(_dept_png(dept_df[["Department", "Compliance %"]]))
     left = Inches(5.2); top = Inches(1.5); width = Inches(4.5)
     chart_slide.shapes.add_picture(img2, left, top, width=width)
 
@@ -140,9 +412,9 @@ def make_powerpoint(summary, weekly_df, dept_df, doc_df, outfile):
     if doc_df.empty:
         p = tf.add_paragraph(); p.text = "No licensing risks detected."; p.level = 0
     else:
-        for _, r in doc_df.iterrows():
+        for doctor_name, expiry, risk in doc_df[["Doctor","License Expiry","Risk"]].itertuples(index=False, name=None):
             p = tf.add_paragraph()
-            p.text = f"{r['Doctor']} — License Expires: {r['License Expiry']} — Status: {r['Risk']}"
+            p.text = f"{doctor_name} — License Expires: {expiry} — Status: {risk}"
             p.level = 0
 
     prs.save(outfile)
@@ -153,17 +425,15 @@ default_path = Path("data/Healthcare CaseStudy Data.xlsx")
 use_bundled = st.sidebar.checkbox("Use bundled example", value=default_path.exists())
 uploaded = None
 if use_bundled and default_path.exists():
-    uploaded = default_path.open("rb")
-    uploaded.name = default_path.name
+    uploaded = default_path
 else:
     uploaded = st.sidebar.file_uploader("Upload Excel/CSV", type=["xlsx","xls","csv"])
 
-raw = load_data(uploaded)
-if raw.empty:
+cols = read_columns(uploaded)
+if not cols:
     st.stop()
 
 st.sidebar.header("2) Map Columns")
-cols = raw.columns.tolist()
 # Common columns (choose the best match)
 visit_date_col = st.sidebar.selectbox("Visit date column", cols, index=next((i for i,c in enumerate(cols) if 'date' in c.lower()), 0))
 department_col = st.sidebar.selectbox("Department column", cols, index=next((i for i,c in enumerate(cols) if 'dept' in c.lower() or 'department' in c.lower()), 0))
@@ -185,40 +455,50 @@ doctor_col = st.sidebar.selectbox("Doctor column", cols, index=next((i for i,c i
 license_expiry_col = st.sidebar.selectbox("License expiry date column (optional)", ["<None>"] + cols, index=0)
 license_expiry_col = None if license_expiry_col == "<None>" else license_expiry_col
 
+# Load only the mapped columns; large CSV uploads are streamed in chunks instead
+mapped_cols = list(dict.fromkeys(c for c in (visit_date_col, department_col, waiting_minutes_col, start_time_col,
+                                             seen_time_col, doctor_col, license_expiry_col) if c))
+stream_csv = is_large_csv(uploaded)
+
 st.sidebar.header("3) Parameters")
 target_minutes = st.sidebar.number_input("Compliance target (max waiting minutes)", min_value=1, max_value=600, value=DEFAULT_TARGET_MIN, step=1)
 dept_threshold = st.sidebar.slider("Department compliant if ≥ this %", min_value=0, max_value=100, value=90, step=1)
 alert_days = st.sidebar.slider("License expiring soon (days)", min_value=1, max_value=365, value=DEFAULT_ALERT_DAYS, step=1)
 
 # ---------- Prepare Data ----------
-df = raw.copy()
-# Coerce dates
-df[visit_date_col] = coerce_datetime(df[visit_date_col])
-
-if waiting_mode == "Numeric minutes column":
-    df["waiting_minutes"] = coerce_numeric(df[waiting_minutes_col])
+if stream_csv:
+    total_visits, compliant_visits, has_minutes, weekly, dept_series, doctor = _stream_csv(
+        uploaded.getvalue(), mapped_cols, visit_date_col, department_col, doctor_col,
+        waiting_minutes_col, start_time_col, seen_time_col, license_expiry_col, target_minutes)
 else:
-    df[start_time_col] = coerce_datetime(df[start_time_col])
-    df[seen_time_col] = coerce_datetime(df[seen_time_col])
-    df["waiting_minutes"] = (df[seen_time_col] - df[start_time_col]).dt.total_seconds() / 60.0
-
-df["is_compliant"] = df["waiting_minutes"] <= target_minutes
+    result = _summarize(uploaded, data_key(uploaded), mapped_cols, visit_date_col, department_col, doctor_col,
+                        waiting_minutes_col, start_time_col, seen_time_col, license_expiry_col, target_minutes)
+    if result is None:
+        st.stop()
+    total_visits, compliant_visits, has_minutes, weekly, dept_series, doctor = result
+
+# A wrong column mapping coerces everything to NaN/NaT: stop before any group-by, chart or export
+if total_visits == 0:
+    st.warning("No valid visit dates after coercion — check column mapping.")
+    st.stop()
+if not has_minutes:
+    st.error("No valid waiting times after coercion — check the waiting-time column mapping.")
+    st.stop()
 
-# Week start (Monday)
-df = df.dropna(subset=[visit_date_col])
-df["week_start"] = infer_week_start(df[visit_date_col])
+dept = dept_series.reset_index()
+dept.columns = ["Department", "Compliance %"]
 
 # ---------- KPIs ----------
-total_visits = len(df)
-noncompliant_pct = (1.0 - df["is_compliant"].mean()) * 100 if total_visits > 0 else 0.0
+noncompliant_pct = (1.0 - compliant_visits / total_visits) * 100 if total_visits > 0 else 0.0
 
 colA, colB, colC, colD = st.columns(4)
 colA.metric("Total Visits", f"{total_visits:,}")
 colB.metric("% Noncompliant", f"{noncompliant_pct:.1f}%")
 # Best/Worst departments by compliance
-dept_stats = df.groupby(department_col)["is_compliant"].mean().mul(100).sort_values(ascending=False) if total_visits else pd.Series(dtype=float)
-best_dept = dept_stats.index[0] if not dept_stats.empty else "-"
-worst_dept = dept_stats.index[-1] if not dept_stats.empty else "-"
+# O(n) selection; the full sort only happens once, for the department table
+best_stat, worst_stat = dept_series.nlargest(1), dept_series.nsmallest(1)
+best_dept = best_stat.index[0] if not dept_series.empty else "-"
+worst_dept = worst_stat.index[0] if not dept_series.empty else "-"
 colC.metric("Best Dept", best_dept if isinstance(best_dept, str) else str(best_dept))
 colD.metric("Worst Dept", worst_dept if isinstance(worst_dept, str) else str(worst_dept))
 
@@ -231,42 +511,30 @@ tab1, tab2, tab3, tab4, tab5 = st.tabs([
 
 with tab1:
     st.subheader("Weekly Waiting-Time Compliance (%)")
-    weekly = df.groupby("week_start")["is_compliant"].mean().mul(100).reset_index().rename(columns={"is_compliant":"compliance_pct"})
     st.line_chart(weekly.set_index("week_start"))
     st.dataframe(weekly)
 
 with tab2:
     st.subheader("Department-wise Performance (Traffic Lights)")
-    dept = df.groupby(department_col)["is_compliant"].mean().mul(100).reset_index()
-    dept.columns = ["Department", "Compliance %"]
-    dept["Indicator"] = dept["Compliance %"].apply(lambda p: "🟢" if p >= dept_threshold else "🔴")
+    # Vectorized traffic light: NaN compares False, so it falls through to the ⚪ check
+    dept["Indicator"] = np.where(dept["Compliance %"] >= dept_threshold, "🟢",
+                                 np.where(dept["Compliance %"].isna(), "⚪", "🔴"))
     st.dataframe(dept.sort_values("Compliance %", ascending=False))
     st.bar_chart(dept.set_index("Department")["Compliance %"])
 
 with tab3:
     st.subheader("Doctor-level Compliance & Licensing Issues")
-    doctor = df.groupby(doctor_col)["is_compliant"].agg(["mean","count"]).reset_index()
-    doctor["Compliance %"] = doctor["mean"]*100
-    doctor.rename(columns={doctor_col:"Doctor", "count":"Visits"}, inplace=True)
     # Licensing
     today = pd.Timestamp.today().normalize()
     if license_expiry_col:
-        df[license_expiry_col] = coerce_datetime(df[license_expiry_col])
-        latest_expiry = df.groupby(doctor_col)[license_expiry_col].max().reset_index()
-        latest_expiry.rename(columns={doctor_col:"Doctor", license_expiry_col:"License Expiry"}, inplace=True)
-        doctor = doctor.merge(latest_expiry, on="Doctor", how="left")
         doctor["Days to Expiry"] = (doctor["License Expiry"] - today).dt.days
-        def risk_label(row):
-            d = row["Days to Expiry"]
-            if pd.isna(d): return "Unknown"
-            if d < 0: return "⛔ Expired"
-            if d <= alert_days: return "⚠️ Expiring Soon"
-            return "OK"
-        doctor["Risk"] = doctor.apply(risk_label, axis=1)
+        d = doctor["Days to Expiry"].to_numpy(dtype=float)
+        codes = np.where(np.isnan(d), 0, np.where(d < 0, 1, np.where(d <= alert_days, 2, 3))).astype(np.int8)
+        doctor["Risk"] = pd.Categorical.from_codes(codes, categories=RISK_LEVELS)
     else:
         doctor["License Expiry"] = pd.NaT
         doctor["Days to Expiry"] = np.nan
-        doctor["Risk"] = "Unknown"
+        doctor["Risk"] = pd.Categorical.from_codes(np.zeros(len(doctor), np.int8), categories=RISK_LEVELS)
 
     out_cols = ["Doctor", "Visits", "Compliance %", "License Expiry", "Days to Expiry", "Risk"]
     st.dataframe(doctor[out_cols].sort_values(["Risk","Compliance %"], ascending=[True, False]))
@@ -304,15 +572,15 @@ with tab4:
 with tab5:
     st.subheader("Download Tables")
     # Weekly CSV
-    weekly_csv = weekly.to_csv(index=False).encode("utf-8")
+    weekly_csv = _csv_bytes(weekly)
     st.download_button("Download Weekly Compliance (CSV)", weekly_csv, "weekly_compliance.csv", "text/csv")
 
     # Department CSV
-    dept_csv = dept.to_csv(index=False).encode("utf-8")
+    dept_csv = _csv_bytes(dept)
     st.download_button("Download Department Performance (CSV)", dept_csv, "department_performance.csv", "text/csv")
 
     # Doctor CSV
-    doctor_csv = doctor[out_cols].to_csv(index=False).encode("utf-8")
+    doctor_csv = _csv_bytes(doctor[out_cols])
     st.download_button("Download Doctor Compliance & Licensing (CSV)", doctor_csv, "doctor_compliance_licensing.csv", "text/csv")
 
     st.divider()
@@ -323,9 +591,9 @@ with tab5:
             f"Total visits analyzed: {total_visits:,}",
             f"Noncompliant visits: {noncompliant_pct:.1f}%",
         ]
-        if not dept_stats.empty:
-            bullets.append(f"Best department: {best_dept} ({dept_stats.iloc[0]:.1f}%)")
-            bullets.append(f"Worst department: {worst_dept} ({dept_stats.iloc[-1]:.1f}%)")
+        if not dept_series.empty:
+            bullets.append(f"Best department: {best_dept} ({best_stat.iloc[0]:.1f}%)")
+            bullets.append(f"Worst department: {worst_dept} ({worst_stat.iloc[0]:.1f}%)")
         if license_expiry_col:
             exp_count = int((doctor['Risk'] == '⛔ Expired').sum())
             soon_count = int((doctor['Risk'] == '⚠️ Expiring Soon').sum())
@@ -3,13 +3,32 @@
 # Reads the Excel file, computes summaries, and writes CSV outputs.
 # Schedule this with Windows Task Scheduler or cron.
 
+import json
+import os
+import uuid
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 from pathlib import Path
 import datetime as dt
 
+try:
+    import duckdb
+except ImportError:  # Polars/pandas fallbacks in main()
+    duckdb = None
+
+try:
+    import polars as pl
+except ImportError:  # pandas fallback in main()
+    pl = None
+
 SOURCE = Path("data/Healthcare CaseStudy Data.xlsx")  # adjust if needed
 OUTDIR = Path("data/derived")
 OUTDIR.mkdir(parents=True, exist_ok=True)
+CACHE = OUTDIR / "source.parquet"  # columnar copy of SOURCE, rebuilt when the workbook changes
 
 # ---- Edit these to match your schema ----
 VISIT_DATE = "Visit Date"          # e.g., 'Visit Date'
@@ -19,39 +38,242 @@ DOCTOR = "Doctor"                  # doctor name column
 LICENSE_EXPIRY = "License Expiry"  # optional, if present
 TARGET_MINUTES = 30
 
+# Text date formats, tried in order; month-first before day-first like pandas' own guess
+DATE_FORMATS = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y"]
+
 def _infer_week_start(d):
     d = pd.to_datetime(d, errors="coerce")
-    return (d - pd.to_timedelta(d.dt.dayofweek, unit="d")).dt.normalize()
+    return d.dt.to_period("W-SUN").dt.start_time
 
-def main():
-    df = pd.read_excel(SOURCE)
-    # Coerce
+def detect_date_format(values):
+    # First of DATE_FORMATS that parses every value in a small sample, or None
+    sample = pd.Series(values).dropna().head(10)
+    for fmt in DATE_FORMATS:
+        try:
+            pd.to_datetime(sample, format=fmt, errors="raise")
+        except (ValueError, TypeError):
+            continue
+        return fmt
+    return None
+
+def _signature(path):
+    stat = Path(path).stat()
+    return {"source": str(Path(path).resolve()), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def atomic_write(path, write):
+    # write(tmp) into the same directory, then rename over `path`: concurrent refreshes (app
+    # sessions, the scheduled job) never interleave, and readers never see a partial file.
+    # Created by write() itself so it gets the usual umask permissions (mkstemp's are 0600)
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+def _refresh_cache(path, cache=CACHE):
+    # Parse the workbook only when its size/mtime differ from the last conversion
+    meta = cache.with_suffix(".json")
+    signature = _signature(path)
+    try:
+        if cache.exists() and json.loads(meta.read_text()) == signature:
+            return cache
+    except (OSError, ValueError):
+        pass
+    df = pd.read_excel(path)
+    # Mixed-type object columns (common in Excel exports) cannot be written to Parquet as-is
+    obj_cols = df.select_dtypes("object").columns
+    df[obj_cols] = df[obj_cols].astype("string")
+    atomic_write(cache, lambda tmp: df.to_parquet(tmp, engine="pyarrow", compression="zstd", index=False))
+    # Signature only once the data it describes is in place
+    atomic_write(meta, lambda tmp: Path(tmp).write_text(json.dumps(signature)))
+    return cache
+
+def source_columns(path, cache=CACHE):
+    return pq.read_schema(_refresh_cache(path, cache)).names
+
+def load_source(path, columns=None, cache=CACHE):
+    # Read the Parquet cache of `path`, materializing only `columns` (those present) if given
+    cache = _refresh_cache(path, cache)
+    if columns is not None:
+        available = set(pq.read_schema(cache).names)
+        columns = [c for c in dict.fromkeys(columns) if c in available]
+    return pd.read_parquet(cache, columns=columns)
+
+def _is_whole(column, unit):
+    return pc.all(pc.equal(pc.floor_temporal(column, unit=unit), column)).as_py()
+
+def _to_arrow(df):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Write timestamps like pandas does: naive all-midnight columns as plain dates, whole seconds
+    # without nanosecond digits. pc.cast truncates silently, hence the checks; tz-aware keep their offset
+    for i, field in enumerate(table.schema):
+        if not pa.types.is_timestamp(field.type):
+            continue
+        column = table.column(i)
+        if field.type.tz is None and _is_whole(column, "day"):
+            table = table.set_column(i, field.name, pc.cast(column, pa.date32()))
+        elif _is_whole(column, "second"):
+            table = table.set_column(i, field.name, pc.cast(column, pa.timestamp("s", field.type.tz)))
+    return table
+
+def to_csv_bytes(df):
+    # Arrow's multi-threaded C++ CSV writer; pandas for frames Arrow cannot convert
+    try:
+        buf = pa.BufferOutputStream()
+        pacsv.write_csv(_to_arrow(df), buf)
+        return buf.getvalue().to_pybytes()
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return df.to_csv(index=False).encode("utf-8")
+
+def _summaries_pandas(df):
+    # Coerce (same dtypes as app.prepare_frame); missing minutes count as noncompliant
     df[VISIT_DATE] = pd.to_datetime(df[VISIT_DATE], errors="coerce")
-    df["waiting_minutes"] = pd.to_numeric(df[WAIT_MINUTES], errors="coerce")
-    df["is_compliant"] = df["waiting_minutes"] <= TARGET_MINUTES
+    df["waiting_minutes"] = pd.to_numeric(df[WAIT_MINUTES], errors="coerce").astype("float32")
+    df["is_compliant"] = (df["waiting_minutes"] <= TARGET_MINUTES).to_numpy(dtype=np.bool_, copy=False)
     df["week_start"] = _infer_week_start(df[VISIT_DATE])
+    for c in (DEPARTMENT, DOCTOR):
+        df[c] = df[c].astype("category")
 
     # Weekly
     weekly = df.groupby("week_start")["is_compliant"].mean().mul(100).reset_index()
     weekly.rename(columns={"is_compliant":"compliance_pct"}, inplace=True)
-    weekly.to_csv(OUTDIR / "weekly_compliance.csv", index=False)
 
     # Department
-    dept = df.groupby(DEPARTMENT)["is_compliant"].mean().mul(100).reset_index()
+    dept = df.groupby(DEPARTMENT, observed=True)["is_compliant"].mean().mul(100).reset_index()
     dept.rename(columns={"is_compliant":"Compliance %", DEPARTMENT:"Department"}, inplace=True)
-    dept.to_csv(OUTDIR / "department_performance.csv", index=False)
 
     # Doctor + License
-    doctor = df.groupby(DOCTOR)["is_compliant"].agg(["mean","count"]).reset_index()
+    doctor = df.groupby(DOCTOR, observed=True)["is_compliant"].agg(["mean","count"]).reset_index()
     doctor["Compliance %"] = doctor["mean"]*100
     doctor.rename(columns={DOCTOR:"Doctor", "count":"Visits"}, inplace=True)
     if LICENSE_EXPIRY in df.columns:
-        now = pd.Timestamp.today().normalize()
-        latest_expiry = df.groupby(DOCTOR)[LICENSE_EXPIRY].max().reset_index()
+        latest_expiry = df.groupby(DOCTOR, observed=True)[LICENSE_EXPIRY].max().reset_index()
         latest_expiry.rename(columns={DOCTOR:"Doctor", LICENSE_EXPIRY:"License Expiry"}, inplace=True)
         doctor = doctor.merge(latest_expiry, on="Doctor", how="left")
+    return weekly, dept, doctor
+
+def _text_date_formats(cache, names):
+    # {column: format} for the date columns stored as text in the cache. None if one matches no
+    # DATE_FORMATS entry: the caller then uses pandas' inference rather than an engine's own guess
+    schema = pq.read_schema(cache)
+    formats = {}
+    for name in names:
+        if name not in schema.names:
+            continue
+        dtype = schema.field(name).type
+        if pa.types.is_string(dtype) or pa.types.is_large_string(dtype):
+            column = pq.read_table(cache, columns=[name]).column(0)
+            fmt = detect_date_format(column.drop_null().slice(0, 10).to_pylist())
+            if fmt is None:
+                return None
+            formats[name] = fmt
+    return formats
+
+def _pl_datetime(name, dtype, formats):
+    col = pl.col(name)
+    if dtype == pl.String:
+        return col.str.to_datetime(formats[name], strict=False)
+    return col.cast(pl.Datetime, strict=False)
+
+def _summaries_polars(cache, formats):
+    # One lazy plan: collect_all lets the three group-bys share a single Parquet scan
+    lf = pl.scan_parquet(cache)
+    schema = lf.collect_schema()
+    lf = lf.with_columns(
+        _pl_datetime(VISIT_DATE, schema[VISIT_DATE], formats),
+        (pl.col(WAIT_MINUTES).cast(pl.Float32, strict=False) <= TARGET_MINUTES).fill_null(False).alias("is_compliant"),
+    ).with_columns(pl.col(VISIT_DATE).dt.truncate("1w").alias("week_start"))
+    pct = pl.col("is_compliant").mean() * 100
+
+    weekly = (lf.drop_nulls("week_start").group_by("week_start")
+              .agg(pct.alias("compliance_pct")).sort("week_start"))
+    dept = (lf.drop_nulls(DEPARTMENT).group_by(DEPARTMENT)
+            .agg(pct.alias("Compliance %")).sort(DEPARTMENT).rename({DEPARTMENT:"Department"}))
+    doctor_aggs = [pl.len().alias("Visits"), pct.alias("Compliance %")]
+    if LICENSE_EXPIRY in schema:
+        doctor_aggs.append(_pl_datetime(LICENSE_EXPIRY, schema[LICENSE_EXPIRY], formats).max().alias("License Expiry"))
+    doctor = (lf.drop_nulls(DOCTOR).group_by(DOCTOR)
+              .agg(doctor_aggs).sort(DOCTOR).rename({DOCTOR:"Doctor"}))
+    return [frame.to_pandas() for frame in pl.collect_all([weekly, dept, doctor])]
+
+def _sql_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _sql_str(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+def _sql_timestamp(name, formats):
+    # TRY_CAST only parses ISO text, so text dates go through their detected format
+    if name in formats:
+        return f"TRY_STRPTIME({_sql_ident(name)}, {_sql_str(formats[name])})"
+    return f"TRY_CAST({_sql_ident(name)} AS TIMESTAMP)"
+
+def _write_summaries_duckdb(cache, formats):
+    # Aggregate straight from the Parquet cache into the CSVs: DuckDB reads only the
+    # referenced columns and no intermediate DataFrame is built
+    con = duckdb.connect()
+    has_license = LICENSE_EXPIRY in pq.read_schema(cache).names
+    license_col = f", {_sql_timestamp(LICENSE_EXPIRY, formats)} AS license_expiry" if has_license else ""
+    con.execute(f"""
+        CREATE VIEW visits AS SELECT
+            {_sql_timestamp(VISIT_DATE, formats)} AS visit_date,
+            {_sql_ident(DEPARTMENT)} AS department,
+            {_sql_ident(DOCTOR)} AS doctor,
+            COALESCE(TRY_CAST({_sql_ident(WAIT_MINUTES)} AS FLOAT) <= {TARGET_MINUTES}, false)::DOUBLE AS is_compliant
+            {license_col}
+        FROM read_parquet({_sql_str(cache)})
+    """)
+    con.execute(f"""
+        COPY (SELECT CAST(date_trunc('week', visit_date) AS DATE) AS week_start, AVG(is_compliant) * 100 AS compliance_pct
+              FROM visits WHERE visit_date IS NOT NULL GROUP BY 1 ORDER BY 1)
+        TO {_sql_str(OUTDIR / "weekly_compliance.csv")} (HEADER)
+    """)
+    con.execute(f"""
+        COPY (SELECT department AS "Department", AVG(is_compliant) * 100 AS "Compliance %"
+              FROM visits WHERE department IS NOT NULL GROUP BY 1 ORDER BY 1)
+        TO {_sql_str(OUTDIR / "department_performance.csv")} (HEADER)
+    """)
+    license_aggs = ""
+    if has_license:
+        # Written as plain dates only when no doctor's latest expiry has a time of day, like to_csv_bytes
+        date_only = con.execute("""
+            SELECT COALESCE(bool_and(expiry = date_trunc('day', expiry)), true)
+            FROM (SELECT MAX(license_expiry) AS expiry FROM visits WHERE doctor IS NOT NULL GROUP BY doctor)
+        """).fetchone()[0]
+        expiry = "CAST(MAX(license_expiry) AS DATE)" if date_only else "MAX(license_expiry)"
+        license_aggs = (f", {expiry} AS {_sql_ident('License Expiry')}"
+                        f", date_diff('day', current_date, MAX(license_expiry)) AS {_sql_ident('Days to Expiry')}")
+    con.execute(f"""
+        COPY (SELECT doctor AS "Doctor", COUNT(*) AS "Visits", AVG(is_compliant) * 100 AS "Compliance %"{license_aggs}
+              FROM visits WHERE doctor IS NOT NULL GROUP BY 1 ORDER BY 1)
+        TO {_sql_str(OUTDIR / "doctor_compliance_licensing.csv")} (HEADER)
+    """)
+    con.close()
+
+def main():
+    cache = _refresh_cache(SOURCE)
+    formats = _text_date_formats(cache, [VISIT_DATE, LICENSE_EXPIRY])
+    if duckdb is not None and formats is not None:
+        _write_summaries_duckdb(cache, formats)
+        print("Refresh complete. CSVs written to", OUTDIR.resolve())
+        return
+
+    if pl is not None and formats is not None:
+        weekly, dept, doctor = _summaries_polars(cache, formats)
+    else:
+        weekly, dept, doctor = _summaries_pandas(
+            load_source(SOURCE, columns=[VISIT_DATE, DEPARTMENT, WAIT_MINUTES, DOCTOR, LICENSE_EXPIRY]))
+
+    if "License Expiry" in doctor.columns:
+        now = pd.Timestamp.today().normalize()
         doctor["Days to Expiry"] = (pd.to_datetime(doctor["License Expiry"], errors="coerce") - now).dt.days
-    doctor[["Doctor","Visits","Compliance %","License Expiry","Days to Expiry"]].to_csv(OUTDIR / "doctor_compliance_licensing.csv", index=False)
+    doctor_cols = [c for c in ["Doctor","Visits","Compliance %","License Expiry","Days to Expiry"] if c in doctor.columns]
+
+    (OUTDIR / "weekly_compliance.csv").write_bytes(to_csv_bytes(weekly))
+    (OUTDIR / "department_performance.csv").write_bytes(to_csv_bytes(dept))
+    (OUTDIR / "doctor_compliance_licensing.csv").write_bytes(to_csv_bytes(doctor[doctor_cols]))
 
     print("Refresh complete. CSVs written to", OUTDIR.resolve())
 